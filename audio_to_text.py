@@ -1,15 +1,429 @@
-import base64
+import asyncio
+import hashlib
+import io
+import json
+import logging
 import os
-import tempfile
-import whisper
-import torch
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
 
-MODEL_NAME = "base"
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+import ctranslate2
+import numpy as np
+import soundfile as sf
+from faster_whisper import WhisperModel
+from faster_whisper.tokenizer import Tokenizer
+from scipy.signal import resample_poly
 
-model = whisper.load_model(MODEL_NAME).to(DEVICE)
+logger = logging.getLogger(__name__)
 
-def audio_to_text(base64_audio: str) -> str:
+# SIMD base64 when available; same API as the stdlib module
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# Transcripts are short English intent phrases for the LLM, so the small
+# English-only model is enough. Override with e.g. WHISPER_MODEL=base or
+# WHISPER_MODEL=distil-small.en.
+MODEL_NAME = os.getenv("WHISPER_MODEL", "tiny.en")
+LANGUAGE = "en"
+DEVICE = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+SAMPLE_RATE = 16000
+
+# Micro-batching: concurrent requests arriving within MAX_WAIT_MS of each
+# other share one encoder/decoder pass (up to MAX_BATCH clips).
+MAX_BATCH = 8
+MAX_WAIT_MS = 20
+
+# Transcripts of recently seen clips, keyed by SHA-1 of the WAV bytes
+CACHE_SIZE = 256
+
+# CTranslate2 has no autograd and ignores torch.backends flags; the knob
+# that matters is precision. It only reports fp16 compute types on GPUs
+# with fp16 Tensor cores (sm_70+), so those get int8 weights + fp16
+# matmuls; older GPUs and CPUs run plain int8.
+if DEVICE == "cuda" and "int8_float16" in ctranslate2.get_supported_compute_types(DEVICE):
+    _DEFAULT_COMPUTE_TYPE = "int8_float16"
+else:
+    _DEFAULT_COMPUTE_TYPE = "int8"
+# Override (e.g. float16, float32) to check int8 WER against full precision
+COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", _DEFAULT_COMPUTE_TYPE)
+
+# Inference backend: "ct2" (faster-whisper, default), "trtllm"
+# (TensorRT-LLM engines, CUDA only) or "onnx" (ONNX Runtime export).
+# Falls back to ct2 if the engines / export are not on disk.
+BACKEND = os.getenv("WHISPER_BACKEND", "ct2")
+TRT_ENGINE_DIR = os.getenv("WHISPER_TRT_ENGINE_DIR", f"engines/whisper-{MODEL_NAME}")
+ONNX_DIR = os.getenv("WHISPER_ONNX_DIR", "whisper_onnx")
+# Upper bound on generated tokens per clip for the TensorRT-LLM / ONNX decoders
+MAX_NEW_TOKENS = 96
+
+
+class _WhisperBackend:
+    """
+    Decode setup shared by the backends, built once per model load rather
+    than per batch: every request uses the same tokenizer and prompt.
+    """
+
+    def _init_decoding(self):
+        self.tokenizer = Tokenizer(
+            self.hf_tokenizer,
+            self.is_multilingual,
+            task="transcribe",
+            language=LANGUAGE,
+        )
+        # Fixed language (no detection pass) and <|notimestamps|>: the
+        # decoder emits text tokens only, never timestamp tokens.
+        self.prompt = self.tokenizer.sot_sequence + [self.tokenizer.no_timestamps]
+
+
+class _CT2Whisper(_WhisperBackend):
+    """faster-whisper model; generate() runs on CTranslate2."""
+
+    def __init__(self):
+        self.model = WhisperModel(MODEL_NAME, device=DEVICE, compute_type=COMPUTE_TYPE)
+        self.feature_extractor = self.model.feature_extractor
+        self.hf_tokenizer = self.model.hf_tokenizer
+        self.is_multilingual = self.model.model.is_multilingual
+        self._init_decoding()
+
+    def generate(self, features: np.ndarray, prompts: List[List[int]]) -> List[List[int]]:
+        results = self.model.model.generate(
+            ctranslate2.StorageView.from_array(features),
+            prompts,
+            beam_size=1,
+        )
+        return [r.sequences_ids[0] for r in results]
+
+
+def _read_json(*path: str) -> Dict:
+    with open(os.path.join(*path)) as f:
+        return json.load(f)
+
+
+class _TRTLLMWhisper(_WhisperBackend):
+    """
+    TensorRT-LLM encoder/decoder engines, built offline with the
+    TensorRT-LLM whisper example (build with --dtype float16
+    --max_batch_size 8) into TRT_ENGINE_DIR/{encoder,decoder}. Copy the
+    model's tokenizer.json (from its Hugging Face repo) next to them.
+    """
+
+    def __init__(self, engine_dir: str):
+        import tokenizers
+        import torch
+        from faster_whisper.feature_extractor import FeatureExtractor
+        from tensorrt_llm.runtime import ModelRunnerCpp
+
+        self._torch = torch
+        self.runner = ModelRunnerCpp.from_dir(
+            engine_dir=engine_dir,
+            is_enc_dec=True,
+            max_batch_size=MAX_BATCH,
+            max_input_len=3000,
+            max_output_len=MAX_NEW_TOKENS,
+            max_beam_width=1,
+        )
+        # Mel bins and vocabulary differ across models (large-v3: 128 mels,
+        # 51866 tokens), so both come from the engines' own build configs.
+        # Multilingual vocabularies have >= 51865 tokens, as in whisper.
+        encoder_config = _read_json(engine_dir, "encoder", "config.json")["pretrained_config"]
+        decoder_config = _read_json(engine_dir, "decoder", "config.json")["pretrained_config"]
+        self.feature_extractor = FeatureExtractor(feature_size=encoder_config["n_mels"])
+        self.is_multilingual = decoder_config["vocab_size"] >= 51865
+        self.hf_tokenizer = tokenizers.Tokenizer.from_file(
+            os.path.join(engine_dir, "tokenizer.json")
+        )
+        self.eot = self.hf_tokenizer.token_to_id("<|endoftext|>")
+        self._init_decoding()
+
+    def generate(self, features: np.ndarray, prompts: List[List[int]]) -> List[List[int]]:
+        torch = self._torch
+        # Engine expects (frames, n_mels) fp16 per clip
+        mel = torch.from_numpy(features).to("cuda", torch.float16).transpose(1, 2)
+        with torch.inference_mode():
+            outputs = self.runner.generate(
+                batch_input_ids=[torch.tensor(p, dtype=torch.int32) for p in prompts],
+                encoder_input_features=list(mel),
+                encoder_output_lengths=torch.full(
+                    (len(prompts),), mel.shape[1] // 2, dtype=torch.int32, device="cuda"
+                ),
+                max_new_tokens=MAX_NEW_TOKENS,
+                end_id=self.eot,
+                pad_id=self.eot,
+                num_beams=1,
+                return_dict=True,
+            )
+        # Prompt + padding tokens are >= eot and dropped by Tokenizer.decode
+        return outputs["output_ids"][:, 0].tolist()
+
+
+class _ORTWhisper(_WhisperBackend):
+    """
+    ONNX Runtime export of Whisper, e.g.
+        optimum-cli export onnx --model openai/whisper-tiny.en whisper_onnx/
+    Inputs and outputs are bound with IOBinding so encoder hidden states
+    and the decoder KV cache stay on the GPU between session runs; only
+    token ids go in and last-position logits come out.
+    """
+
+    def __init__(self, onnx_dir: str):
+        import onnxruntime as ort
+        import tokenizers
+        from faster_whisper.feature_extractor import FeatureExtractor
+
+        self._ort = ort
+        providers = ["CPUExecutionProvider"]
+        if DEVICE == "cuda":
+            providers.insert(0, ("CUDAExecutionProvider", {"device_id": 0}))
+
+        def session(name):
+            return ort.InferenceSession(os.path.join(onnx_dir, name), providers=providers)
+
+        self.encoder = session("encoder_model.onnx")
+        self.decoder = session("decoder_model.onnx")
+        self.decoder_with_past = session("decoder_with_past_model.onnx")
+        # ORT silently drops to CPU when its build has no CUDA provider,
+        # so bind buffers wherever the sessions actually landed
+        self.device = (
+            "cuda" if self.encoder.get_providers()[0] == "CUDAExecutionProvider" else "cpu"
+        )
+        # fp16 exports (--fp16) take float16 mels
+        self.mel_dtype = (
+            np.float16 if self.encoder.get_inputs()[0].type == "tensor(float16)" else np.float32
+        )
+
+        self.hf_tokenizer = tokenizers.Tokenizer.from_file(
+            os.path.join(onnx_dir, "tokenizer.json")
+        )
+        # optimum leaves the mel axis symbolic, so go by vocab size like
+        # whisper does: large-v3 (51866) takes 128 mels, the rest 80
+        vocab_size = self.hf_tokenizer.get_vocab_size()
+        self.feature_extractor = FeatureExtractor(feature_size=128 if vocab_size >= 51866 else 80)
+        self.is_multilingual = vocab_size >= 51865
+        self.eot = self.hf_tokenizer.token_to_id("<|endoftext|>")
+        self._init_decoding()
+
+    def _run_decoder(self, sess, input_ids, hidden, past):
+        binding = sess.io_binding()
+        for inp in sess.get_inputs():
+            if inp.name == "input_ids":
+                binding.bind_cpu_input("input_ids", input_ids)
+            elif inp.name == "encoder_hidden_states":
+                binding.bind_ortvalue_input(inp.name, hidden)
+            elif inp.name.startswith("past_key_values."):
+                binding.bind_ortvalue_input(inp.name, past[inp.name[len("past_key_values."):]])
+
+        names = [o.name for o in sess.get_outputs()]
+        for name in names:
+            if name == "logits":
+                binding.bind_output(name)
+            else:
+                binding.bind_output(name, self.device, 0)
+
+        sess.run_with_iobinding(binding)
+
+        outputs = dict(zip(names, binding.get_outputs()))
+        for name, value in outputs.items():
+            if name.startswith("present."):
+                past[name[len("present."):]] = value
+        return outputs["logits"].numpy()[:, -1, :]
+
+    def generate(self, features: np.ndarray, prompts: List[List[int]]) -> List[List[int]]:
+        mel = self._ort.OrtValue.ortvalue_from_numpy(
+            features.astype(self.mel_dtype), self.device, 0
+        )
+        binding = self.encoder.io_binding()
+        binding.bind_ortvalue_input(self.encoder.get_inputs()[0].name, mel)
+        binding.bind_output(self.encoder.get_outputs()[0].name, self.device, 0)
+        self.encoder.run_with_iobinding(binding)
+        hidden = binding.get_outputs()[0]
+
+        # Greedy decode. Step 0 runs the full prompt and fills the KV cache;
+        # later steps feed one token each through the with-past decoder.
+        sequences = np.array(prompts, dtype=np.int64)
+        input_ids = sequences
+        finished = np.zeros(len(prompts), dtype=bool)
+        past: Dict[str, object] = {}
+        sess = self.decoder
+
+        for _ in range(MAX_NEW_TOKENS):
+            logits = self._run_decoder(sess, input_ids, hidden, past)
+            next_tokens = np.where(finished, self.eot, logits.argmax(axis=-1))
+            sequences = np.concatenate([sequences, next_tokens[:, None]], axis=1)
+            finished |= next_tokens == self.eot
+            if finished.all():
+                break
+            input_ids = np.ascontiguousarray(next_tokens[:, None], dtype=np.int64)
+            sess = self.decoder_with_past
+
+        # Prompt + padding tokens are >= eot and dropped by Tokenizer.decode
+        return sequences.tolist()
+
+
+# Loaded by load_model() (from the server lifespan, or lazily on first use).
+# Survives importlib.reload, so a reload never loads a second copy.
+if "model" not in globals():
+    model = None
+
+
+def load_model():
+    global model
+    if model is None:
+        if BACKEND == "trtllm" and DEVICE == "cuda" and os.path.isdir(TRT_ENGINE_DIR):
+            model = _TRTLLMWhisper(TRT_ENGINE_DIR)
+        elif BACKEND == "onnx" and os.path.isfile(os.path.join(ONNX_DIR, "encoder_model.onnx")):
+            model = _ORTWhisper(ONNX_DIR)
+        else:
+            if BACKEND != "ct2":
+                if BACKEND == "trtllm":
+                    reason = "no CUDA device" if DEVICE != "cuda" else f"no engines in {TRT_ENGINE_DIR}"
+                elif BACKEND == "onnx":
+                    reason = f"no export in {ONNX_DIR}"
+                else:
+                    reason = "unknown backend"
+                logger.warning(
+                    "WHISPER_BACKEND=%s unavailable (%s); falling back to ct2", BACKEND, reason
+                )
+            model = _CT2Whisper()
+    return model
+
+
+def warmup() -> None:
+    """
+    Load the model and push one second of silence through the batch path,
+    so weights, CUDA context and kernel workspaces are in place before the
+    first real request.
+    """
+    _transcribe_batch([np.zeros(SAMPLE_RATE, dtype=np.float32)])
+
+
+def decode_wav(audio_bytes: bytes) -> np.ndarray:
+    """
+    Parse WAV bytes in-process into mono float32 at 16 kHz.
+    No temp file, no ffmpeg subprocess.
+    """
+    data, sr = sf.read(io.BytesIO(audio_bytes), dtype="float32", always_2d=False)
+
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+
+    if sr != SAMPLE_RATE:
+        data = resample_poly(data, SAMPLE_RATE, sr).astype(np.float32)
+
+    return data
+
+
+# -----------------------------
+# Batched transcription
+# -----------------------------
+
+def _features(audio: np.ndarray) -> np.ndarray:
+    """Log-mel of one clip, padded/trimmed to Whisper's 30 s window."""
+    fe = model.feature_extractor
+    audio = audio[:fe.n_samples]
+    audio = np.pad(audio, (0, fe.n_samples - len(audio)))
+    return fe(audio)[:, :fe.nb_max_frames]
+
+
+def _transcribe_batch(audios: List[np.ndarray]) -> List[str]:
+    """
+    One encoder pass + one greedy decode for a batch of clips.
+    Blocking; called from a worker thread.
+    """
+    load_model()
+
+    features = np.ascontiguousarray(np.stack([_features(a) for a in audios]))
+    tokens = model.generate(features, [model.prompt] * len(audios))
+
+    return [model.tokenizer.decode(t).strip() for t in tokens]
+
+
+class BatchingTranscriber:
+    """
+    Coalesces concurrent audio_to_text() calls into batched model passes.
+    The worker waits for the first clip, collects whatever else arrives
+    within max_wait_ms (up to max_batch), then runs the batch in a thread
+    so the event loop keeps accepting work. Every clip is padded to the
+    same 30 s window, so clips of any length share one batch.
+    """
+
+    def __init__(self, max_batch: int = MAX_BATCH, max_wait_ms: int = MAX_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, audio: np.ndarray) -> str:
+        # Started lazily so it binds to the server's running loop
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((audio, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            items = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(items) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                texts = await asyncio.to_thread(
+                    _transcribe_batch, [audio for audio, _ in items]
+                )
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), text in zip(items, texts):
+                if not future.done():
+                    future.set_result(text)
+
+
+transcriber = BatchingTranscriber()
+
+
+# -----------------------------
+# Transcript cache (LRU)
+# -----------------------------
+
+_cache: "OrderedDict[bytes, str]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cache_get(key: bytes) -> Optional[str]:
+    with _cache_lock:
+        text = _cache.get(key)
+        if text is not None:
+            _cache.move_to_end(key)
+        return text
+
+
+def _cache_put(key: bytes, text: str) -> None:
+    with _cache_lock:
+        _cache[key] = text
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+async def audio_to_text(base64_audio: str) -> str:
     if not base64_audio:
         return ""
 
@@ -24,27 +438,14 @@ def audio_to_text(base64_audio: str) -> str:
 
     audio_bytes = base64.b64decode(base64_audio)
 
-    # ✅ FRONTEND SENDS WAV → SAVE AS WAV
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-        tmp.write(audio_bytes)
-        tmp_path = tmp.name
-
-    try:
-        audio = whisper.load_audio(tmp_path)
-        audio = whisper.pad_or_trim(audio)
-
-        mel = whisper.log_mel_spectrogram(audio).to(model.device)
-
-        result = whisper.decode(
-            model,
-            mel,
-            whisper.DecodingOptions(fp16=(DEVICE == "cuda"))
-        )
+    key = hashlib.sha1(audio_bytes).digest()
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
 
-        return result.text
+    # ✅ FRONTEND SENDS WAV → DECODE IN MEMORY (parse + resample off the loop)
+    audio = await asyncio.to_thread(decode_wav, audio_bytes)
 
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+    text = await transcriber.submit(audio)
+    _cache_put(key, text)
+    return text
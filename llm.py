@@ -1,6 +1,8 @@
 import os
+import re
 import json
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
+import ijson
 from google import genai
 
 client = genai.Client(
@@ -55,6 +57,24 @@ def derive_accessibility_hints(signals: Dict) -> List[str]:
 
 
 # 🔹 NEW: condition-based hints (context, not diagnosis)
+# One compiled alternation instead of a substring scan per keyword;
+# the named group that matched says which hint it maps to.
+_CONDITION_RE = re.compile(
+    r"(?P<cognitive>adhd|attention deficit|\badd\b)"
+    r"|(?P<reading>dyslexia|reading disorder)"
+    r"|(?P<motor>parkinson|motor disorder|tremor|dystonia)"
+    r"|(?P<vision>low vision|visually impaired|poor eyesight)",
+    re.IGNORECASE,
+)
+
+_CONDITION_HINTS = (
+    ("cognitive", "possible_cognitive_load"),
+    ("reading", "possible_reading_difficulty"),
+    ("motor", "possible_motor_difficulty"),
+    ("vision", "possible_low_vision"),
+)
+
+
 def derive_condition_hints(user_text: Optional[str]) -> List[str]:
     """
     Infer accessibility-related context from explicitly mentioned conditions.
@@ -63,28 +83,18 @@ def derive_condition_hints(user_text: Optional[str]) -> List[str]:
     if not user_text:
         return []
 
-    text = user_text.lower()
-    hints = []
-
-    if any(k in text for k in ["adhd", "attention deficit", "add"]):
-        hints.append("possible_cognitive_load")
-
-    if any(k in text for k in ["dyslexia", "reading disorder"]):
-        hints.append("possible_reading_difficulty")
+    matched = {m.lastgroup for m in _CONDITION_RE.finditer(user_text)}
 
-    if any(k in text for k in ["parkinson", "motor disorder", "tremor", "dystonia"]):
-        hints.append("possible_motor_difficulty")
-
-    if any(k in text for k in ["low vision", "visually impaired", "poor eyesight"]):
-        hints.append("possible_low_vision")
-
-    return hints
+    return [hint for group, hint in _CONDITION_HINTS if group in matched]
 
 
 # -----------------------------
 # Safe JSON parsing
 # -----------------------------
 
+# "reason" of the fallback plan; callers use it to tell a failed parse apart
+PARSE_FAILED_REASON = "LLM output parsing failed"
+
 def safe_json_parse(text: str) -> Dict:
     try:
         return json.loads(text)
@@ -104,41 +114,16 @@ def safe_json_parse(text: str) -> Dict:
                 "audio": {"enabled": False},
                 "flashcards": {"enabled": False}
             },
-            "reason": "LLM output parsing failed",
+            "reason": PARSE_FAILED_REASON,
             "confidence": 0.0
         }
 
 
 # -----------------------------
-# Core LLM reasoning function
+# Prompt template
 # -----------------------------
 
-def infer_accessibility_actions(
-    request_type: str,                 # "explicit" | "implicit"
-    user_text: Optional[str],
-    page_text: Optional[str],
-    interaction_signals: Optional[Dict]
-) -> Dict:
-    """
-    Uses an LLM to decide accessibility adaptations.
-    Returns STRICT JSON describing UI + content actions.
-    """
-
-    signals = interaction_signals or {}
-
-    # Existing signal-based hints
-    signal_hints = derive_accessibility_hints(signals)
-
-    # 🔹 NEW: condition-based hints
-    condition_hints = derive_condition_hints(user_text)
-
-    # Merge hints (no duplicates)
-    hints = list(set(signal_hints + condition_hints))
-
-    # Mode decision stays OUTSIDE LLM
-    mode = "apply" if request_type == "explicit" else "suggest"
-
-    prompt = f"""
+_PROMPT_HEAD = """
 You are an accessibility reasoning engine.
 
 IMPORTANT:
@@ -146,17 +131,9 @@ IMPORTANT:
 - Do NOT assume severity.
 - Prefer suggestion mode unless user explicitly requests changes.
 
-INPUTS:
-- Request type: {request_type}
-- Mode (already decided): {mode}
-- User message: {user_text}
-- Interaction signals: {signals}
-- Page content (may be empty): {page_text[:2000] if page_text else "None"}
-
-DERIVED ACCESSIBILITY CONTEXT:
-{hints}
+"""
 
-TASK:
+_PROMPT_TAIL = """TASK:
 1. Use the derived context and user message to infer accessibility friction.
 2. Do NOT change the provided mode.
 3. Decide UI adaptations using ONLY the allowed UI actions.
@@ -191,31 +168,100 @@ UI ACTION CONSTRAINTS:
 - line_spacing ∈ [1.0, 1.6]
 
 JSON SCHEMA:
-{{
+{
   "mode": "apply | suggest",
-  "ui_actions": {{
+  "ui_actions": {
     "font_scale": float,
     "line_spacing": float,
     "contrast": "normal | high",
     "simplify_layout": boolean,
     "hide_distractions": boolean,
     "highlight_focus": boolean
-  }},
-  "content_actions": {{
-    "summary": {{ "enabled": boolean, "length": "short | medium" }},
-    "audio": {{ "enabled": boolean }},
-    "flashcards": {{ "enabled": boolean }}
-  }},
+  },
+  "content_actions": {
+    "summary": { "enabled": boolean, "length": "short | medium" },
+    "audio": { "enabled": boolean },
+    "flashcards": { "enabled": boolean }
+  },
   "reason": string,
   "confidence": float
-}}
+}
 
 Return JSON ONLY.
 """
 
-    response = client.models.generate_content(
+
+# -----------------------------
+# Core LLM reasoning function
+# -----------------------------
+
+def infer_accessibility_actions(
+    request_type: str,                 # "explicit" | "implicit"
+    user_text: Optional[str],
+    page_text: Optional[str],
+    interaction_signals: Optional[Dict],
+    on_content_actions: Optional[Callable[[Dict], None]] = None
+) -> Dict:
+    """
+    Uses an LLM to decide accessibility adaptations.
+    Returns STRICT JSON describing UI + content actions.
+
+    The response is streamed. If given, on_content_actions is called with
+    the "content_actions" object as soon as it has fully arrived, before
+    the rest of the JSON (so callers can start content work early).
+    """
+
+    signals = interaction_signals or {}
+
+    # Existing signal-based hints
+    signal_hints = derive_accessibility_hints(signals)
+
+    # 🔹 NEW: condition-based hints
+    condition_hints = derive_condition_hints(user_text)
+
+    # Merge hints (no duplicates)
+    hints = list(set(signal_hints + condition_hints))
+
+    # Mode decision stays OUTSIDE LLM
+    mode = "apply" if request_type == "explicit" else "suggest"
+
+    # Only the INPUTS block is formatted per call; the instructions and
+    # schema around it are module constants.
+    inputs = f"""INPUTS:
+- Request type: {request_type}
+- Mode (already decided): {mode}
+- User message: {user_text}
+- Interaction signals: {signals}
+- Page content (may be empty): {page_text[:2000] if page_text else "None"}
+
+DERIVED ACCESSIBILITY CONTEXT:
+{hints}
+
+"""
+    prompt = "".join((_PROMPT_HEAD, inputs, _PROMPT_TAIL))
+
+    chunks: List[str] = []
+    found = ijson.sendable_list()
+    parser = ijson.items_coro(found, "content_actions") if on_content_actions else None
+
+    for chunk in client.models.generate_content_stream(
         model="gemini-2.5-flash",
         contents=prompt
-    )
-
-    return safe_json_parse(response.text)
+    ):
+        if not chunk.text:
+            continue
+        chunks.append(chunk.text)
+
+        if parser is None:
+            continue
+        try:
+            parser.send(chunk.text.encode())
+        except ijson.JSONError:
+            # Not bare JSON (e.g. fenced); only the full-text parse applies
+            parser = None
+            continue
+        if found:
+            on_content_actions(found[0])
+            parser = None
+
+    return safe_json_parse("".join(chunks))
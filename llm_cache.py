@@ -0,0 +1,81 @@
+
+# llm_cache.py
+
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from cachetools import TTLCache
+
+from llm import PARSE_FAILED_REASON, infer_accessibility_actions
+from change_modality.summariser import generate_summary
+
+# Repeat visits to the same page (same text / signals / message) reuse
+# the previous Gemini answer instead of another network round-trip.
+CACHE_SIZE = 512
+CACHE_TTL_S = 3600
+
+_summaries: TTLCache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL_S)
+_actions: TTLCache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL_S)
+# cachetools caches are not thread-safe; callers run in worker threads
+_lock = threading.Lock()
+
+
+def _digest(text: Optional[str]) -> Optional[str]:
+    # page_text is already truncated by pipeline.handle_request, so it is
+    # hashed whole
+    if text is None:
+        return None
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def _signals_key(signals: Optional[Dict[str, Any]]) -> Tuple:
+    # dicts aren't hashable; sorted items are, and ignore key order
+    return tuple(sorted((signals or {}).items()))
+
+
+def _get(cache: TTLCache, key):
+    with _lock:
+        return cache.get(key)
+
+
+def _put(cache: TTLCache, key, value) -> None:
+    with _lock:
+        cache[key] = value
+
+
+def cached_summary(page_text: str, length: str) -> str:
+    key = (_digest(page_text), length)
+    summary = _get(_summaries, key)
+    if summary is None:
+        summary = generate_summary(page_text, length)
+        _put(_summaries, key, summary)
+    return summary
+
+
+def cached_actions(
+    request_type: str,
+    user_text: Optional[str],
+    page_text: Optional[str],
+    interaction_signals: Optional[Dict],
+    on_content_actions: Optional[Callable[[Dict], None]] = None
+) -> Dict:
+    key = (
+        request_type,
+        _digest(user_text),
+        _signals_key(interaction_signals),
+        _digest(page_text),
+    )
+    actions = _get(_actions, key)
+    if actions is None:
+        actions = infer_accessibility_actions(
+            request_type=request_type,
+            user_text=user_text,
+            page_text=page_text,
+            interaction_signals=interaction_signals,
+            on_content_actions=on_content_actions
+        )
+        # Never pin a malformed reply's fallback plan for the whole TTL
+        if actions.get("reason") != PARSE_FAILED_REASON:
+            _put(_actions, key, actions)
+    return actions
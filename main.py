@@ -1,13 +1,38 @@
 
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load + warm up Whisper once per worker, before the first request.
+    # Only /process transcribes, so nothing is loaded when that route isn't
+    # registered (pipeline deps missing). ENABLE_AUDIO=0 also skips it (no
+    # model, no GPU) for deployments that never receive audio. A failed
+    # load (no model download, no CUDA) is logged and never takes down
+    # /health and /adapt; audio_to_text retries the load on first use.
+    if PROCESS_ENABLED and os.getenv("ENABLE_AUDIO", "1") != "0":
+        try:
+            from audio_to_text import warmup
+            await asyncio.to_thread(warmup)
+        except Exception:
+            logger.exception("Whisper warmup failed; continuing without it")
+    yield
+
+
 app = FastAPI(
     title="Adaptive Accessibility Backend",
     description="Backend API for real-time UI adaptation",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Allow extension (and local tools) to call the API via fetch.
@@ -75,14 +100,19 @@ def adapt(request: AdaptRequest):
 
 # ── Legacy /process endpoint (requires full pipeline dependencies) ────
 
+# Set once the route below is registered; read by lifespan()
+PROCESS_ENABLED = False
+
 try:
     from schemas import RequestSchema, ResponseSchema
     from pipeline import handle_request
 
     @app.post("/process", response_model=ResponseSchema)
-    def process_request(request: RequestSchema):
+    async def process_request(request: RequestSchema):
         request_dict = request.model_dump()
-        response = handle_request(request_dict)
+        response = await handle_request(request_dict)
         return response
+
+    PROCESS_ENABLED = True
 except Exception:
     pass
@@ -1,59 +1,18 @@
 
+import asyncio
 from typing import Dict, Any, Optional, List
 
-from audio_to_text import audio_to_text
-from llm import infer_accessibility_actions
-from change_modality.summariser import generate_summary
-from change_modality.txt_to_image import text_to_image
-from change_modality.tts import text_to_speech
+from llm_cache import cached_actions, cached_summary
 
-def handle_request(request_json):
-    request_type = request_json["request_type"]
-    payload = request_json["payload"]
+# audio_to_text, tts and txt_to_image are imported where used: they pull
+# in model runtimes that requests without audio / those modalities never need.
 
-    user_text = payload.get("user_text")
-    user_audio = payload.get("user_audio")
-    page_text = (payload.get("page_text") or {}).get("content")
-    interaction_signals = payload.get("interaction_signals")
+# Nothing downstream reads past this many characters of page text
+# (summariser bound), so it is sliced once here rather than per call.
+MAX_PAGE_TEXT_CHARS = 8000
 
-    # Hardwired mode rules (LLM cannot override)
-    desired_mode = "apply" if request_type == "explicit" else "suggest"
 
-    # 1. Audio → text (intent only)
-    if user_audio:
-        user_text = audio_to_text(user_audio["base64"])
-
-    # 2. LLM decides actions
-    actions = infer_accessibility_actions(
-        request_type=request_type,
-        user_text=user_text,
-        page_text=page_text,
-        interaction_signals=interaction_signals
-    )
-
-    # 2b. Shape strictly to schemas.py (never invent / never return extra fields)
-    raw_ui = (actions or {}).get("ui_actions") or {}
-    ui_actions: Dict[str, Any] = {}
-
-    # Clamp/validate common UI action fields defensively
-    def _clamp_float(v: Any, lo: float, hi: float) -> Optional[float]:
-        try:
-            f = float(v)
-        except Exception:
-            return None
-        return max(lo, min(hi, f))
-
-    if raw_ui.get("font_scale") is not None:
-        ui_actions["font_scale"] = _clamp_float(raw_ui.get("font_scale"), 0.8, 2.0)
-    if raw_ui.get("line_spacing") is not None:
-        ui_actions["line_spacing"] = _clamp_float(raw_ui.get("line_spacing"), 0.8, 2.5)
-    if raw_ui.get("contrast") in ("normal", "high"):
-        ui_actions["contrast"] = raw_ui.get("contrast")
-    for k in ("simplify_layout", "hide_distractions", "highlight_focus"):
-        if raw_ui.get(k) is not None:
-            ui_actions[k] = bool(raw_ui.get(k))
-
-    raw_ca = (actions or {}).get("content_actions") or {}
+def _content_flags(raw_ca: Dict[str, Any]):
     summary_cfg = (raw_ca.get("summary") or {})
     audio_cfg = (raw_ca.get("audio") or {})
     flash_cfg = (raw_ca.get("flashcards") or {})
@@ -67,32 +26,161 @@ def handle_request(request_json):
     audio_enabled = bool(audio_cfg.get("enabled", False))
     flash_enabled = bool(flash_cfg.get("enabled", False))
 
-    response: Dict[str, Any] = {
-        "mode": desired_mode,
-        "ui_actions": ui_actions,
-        "content_actions": {
-            "summary": {"enabled": False},
-            "audio": {"enabled": False},
-            "flashcards": {"enabled": False},
-        },
-    }
-
-    # 3. SUMMARY (independent)
-    if page_text and summary_enabled:
-        summary_text = generate_summary(page_text, summary_length)
-        response["content_actions"]["summary"] = {"enabled": True, "text": summary_text}
-
-    # 4. AUDIO (independent)
-    if page_text and audio_enabled:
-        audio_summary = generate_summary(page_text, "short")
-        audio_payload = text_to_speech(audio_summary)
-        response["content_actions"]["audio"] = {"enabled": True, **audio_payload}
-
-    # 5. IMAGE (independent)
-    if page_text and flash_enabled:
-        image_summary = generate_summary(page_text, "short")
-        image_payload = text_to_image(image_summary)
-        response["content_actions"]["flashcards"] = {"enabled": True, **image_payload}
+    return summary_enabled, summary_length, audio_enabled, flash_enabled
+
+
+def _summary_lengths(raw_ca: Dict[str, Any]) -> List[str]:
+    """Summary lengths a decision needs (audio + flashcards use "short")."""
+    summary_enabled, summary_length, audio_enabled, flash_enabled = _content_flags(raw_ca)
+    lengths = []
+    if audio_enabled or flash_enabled:
+        lengths.append("short")
+    if summary_enabled and summary_length not in lengths:
+        lengths.append(summary_length)
+    return lengths
+
+
+def _discard_result(task: asyncio.Task) -> None:
+    # Retrieve the outcome so an unused, failed prefetch isn't logged as
+    # "Task exception was never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+async def handle_request(request_json):
+    request_type = request_json["request_type"]
+    payload = request_json["payload"]
+
+    user_text = payload.get("user_text")
+    user_audio = payload.get("user_audio")
+    page_text = (payload.get("page_text") or {}).get("content")
+    if page_text:
+        page_text = page_text[:MAX_PAGE_TEXT_CHARS]
+    interaction_signals = payload.get("interaction_signals")
+
+    # Hardwired mode rules (LLM cannot override)
+    desired_mode = "apply" if request_type == "explicit" else "suggest"
+
+    # 1. Audio → text (intent only)
+    if user_audio:
+        from audio_to_text import audio_to_text
+        user_text = await audio_to_text(user_audio["base64"])
+
+    # One task per summary length: every branch needing the same length
+    # (e.g. audio + flashcards + a "short" summary) awaits the same call.
+    summary_tasks: Dict[str, asyncio.Task] = {}
+
+    def _summary_task(length: str) -> asyncio.Task:
+        if length not in summary_tasks:
+            summary_tasks[length] = asyncio.create_task(
+                asyncio.to_thread(cached_summary, page_text, length)
+            )
+        return summary_tasks[length]
+
+    # The streamed decision closes content_actions before reason/confidence;
+    # start the summaries it asks for while the rest is still arriving.
+    # Which modalities actually run is still decided from the final actions.
+    loop = asyncio.get_running_loop()
+
+    def _prefetch_summaries(raw_ca: Dict[str, Any]):
+        for length in _summary_lengths(raw_ca):
+            _summary_task(length)
+
+    def _on_content_actions(raw_ca: Dict[str, Any]):
+        # Called from the LLM worker thread; hop back onto the loop
+        if page_text and isinstance(raw_ca, dict):
+            loop.call_soon_threadsafe(_prefetch_summaries, raw_ca)
+
+    try:
+        # 2. LLM decides actions
+        # Blocking network calls run in threads so the event loop stays free
+        # to batch concurrent transcriptions.
+        actions = await asyncio.to_thread(
+            cached_actions,
+            request_type=request_type,
+            user_text=user_text,
+            page_text=page_text,
+            interaction_signals=interaction_signals,
+            on_content_actions=_on_content_actions
+        )
+
+        # 2b. Shape strictly to schemas.py (never invent / never return extra fields)
+        raw_ui = (actions or {}).get("ui_actions") or {}
+        ui_actions: Dict[str, Any] = {}
+
+        # Clamp/validate common UI action fields defensively
+        def _clamp_float(v: Any, lo: float, hi: float) -> Optional[float]:
+            try:
+                f = float(v)
+            except Exception:
+                return None
+            return max(lo, min(hi, f))
+
+        if raw_ui.get("font_scale") is not None:
+            ui_actions["font_scale"] = _clamp_float(raw_ui.get("font_scale"), 0.8, 2.0)
+        if raw_ui.get("line_spacing") is not None:
+            ui_actions["line_spacing"] = _clamp_float(raw_ui.get("line_spacing"), 0.8, 2.5)
+        if raw_ui.get("contrast") in ("normal", "high"):
+            ui_actions["contrast"] = raw_ui.get("contrast")
+        for k in ("simplify_layout", "hide_distractions", "highlight_focus"):
+            if raw_ui.get(k) is not None:
+                ui_actions[k] = bool(raw_ui.get(k))
+
+        raw_ca = (actions or {}).get("content_actions") or {}
+        summary_enabled, summary_length, audio_enabled, flash_enabled = _content_flags(raw_ca)
+
+        response: Dict[str, Any] = {
+            "mode": desired_mode,
+            "ui_actions": ui_actions,
+            "content_actions": {
+                "summary": {"enabled": False},
+                "audio": {"enabled": False},
+                "flashcards": {"enabled": False},
+            },
+        }
+
+        content_actions = response["content_actions"]
+
+        async def _summary():
+            summary_text = await _summary_task(summary_length)
+            content_actions["summary"] = {"enabled": True, "text": summary_text}
+
+        async def _audio():
+            from change_modality.tts import text_to_speech
+            audio_payload = await asyncio.to_thread(text_to_speech, await _summary_task("short"))
+            content_actions["audio"] = {"enabled": True, **audio_payload}
+
+        async def _flashcards():
+            from change_modality.txt_to_image import text_to_image
+            image_payload = await asyncio.to_thread(text_to_image, await _summary_task("short"))
+            content_actions["flashcards"] = {"enabled": True, **image_payload}
+
+        tasks = []
+
+        # 3. SUMMARY (independent)
+        if page_text and summary_enabled:
+            tasks.append(_summary())
+
+        # 4. AUDIO (independent)
+        if page_text and audio_enabled:
+            tasks.append(_audio())
+
+        # 5. IMAGE (independent)
+        if page_text and flash_enabled:
+            tasks.append(_flashcards())
+
+        # Modalities are IO-bound and independent: total latency is the
+        # slowest branch, not the sum.
+        await asyncio.gather(*tasks)
+    finally:
+        # Prefetched summaries the final actions didn't use (the stream
+        # closed content_actions, then the full parse fell back or the
+        # stream dropped and cached_actions raised): cancel what is still
+        # pending and collect every outcome. Awaited tasks are already
+        # done, so this is a no-op for them.
+        for task in summary_tasks.values():
+            task.cancel()
+            task.add_done_callback(_discard_result)
 
     return response
 